@@ -1,86 +1,866 @@
-import random as rn
+import contextlib
+import copy
+import json
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
 import numpy as np
-from numpy.random import choice as np_choice
+
+class Coordinates(object):
+
+    # Mean radius of the Earth in kilometres, for haversine distances
+    EARTH_RADIUS = 6371.0088
+
+    def __init__(self, coords, metric='euclidean'):
+        """
+        Cities given by their coordinates, standing in for the distance
+        matrix of AntColony. Indexing it like the matrix computes the
+        distances asked for, so that memory grows with the number of cities
+        and not with its square. The diagonal is np.inf, like in a matrix.
+
+        Args:
+            coords (2D numpy.array): One row per city, (x, y) for euclidean or (latitude, longitude) in degrees for haversine
+            metric (str): 'euclidean', or 'haversine' for great-circle distances in kilometres. Default='euclidean'
+
+        Example:
+            ant_colony = AntColony(Coordinates(stops, 'haversine'), 20, 5, 500, 0.95, beta=2, n_candidates=15)
+        """
+        if metric not in ('euclidean', 'haversine'):
+            raise ValueError('unknown metric %r' % metric)
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.metric = metric
+        self.shape = (len(self.coords), len(self.coords))
+        self.dtype = self.coords.dtype
+
+        # Points nearest searches in. Haversine cities are placed on the
+        # unit sphere, where the order of chord lengths is the order of
+        # great-circle distances.
+        if metric == 'haversine':
+            lat, lon = np.radians(self.coords).T
+            self.points = np.stack([np.cos(lat) * np.cos(lon),
+                                    np.cos(lat) * np.sin(lon),
+                                    np.sin(lat)], axis=1)
+        else:
+            self.points = self.coords
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, key):
+        """
+        Returns distances like a matrix would: [a, b] between the cities in
+        arrays a and b, broadcast together, and [rows] as full rows.
+        """
+        if isinstance(key, tuple):
+            a, b = np.asarray(key[0]), np.asarray(key[1])
+        else:
+            a, b = np.asarray(key)[..., None], np.arange(len(self))
+        return np.where(a == b, np.inf, self.distance(a, b))[()]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[np.arange(len(self))], dtype=dtype)
+
+    def distance(self, a, b):
+        """
+        Returns the distances between the cities in arrays a and b.
+        """
+        if self.metric == 'euclidean':
+            return np.sqrt(((self.coords[a] - self.coords[b]) ** 2)
+                           .sum(axis=-1))
+        lat1, lon1 = np.moveaxis(np.radians(self.coords[a]), -1, 0)
+        lat2, lon2 = np.moveaxis(np.radians(self.coords[b]), -1, 0)
+        h = (np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2)
+             * np.sin((lon2 - lon1) / 2) ** 2)
+        return 2 * self.EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+    def nearest(self, k):
+        """
+        Returns the k nearest cities of every city, closest first. Cities
+        are split in two at the median of their widest coordinate until
+        each part holds at most 2 * (k + 1), so that the parts follow the
+        cities however they cluster. The neighbours of the cities of a part
+        are among the parts whose boxes are not further away than the k-th
+        nearest city within the part itself.
+        """
+        points = self.points
+        n = len(points)
+        nearest = np.empty((n, k), dtype=np.intp)
+        if not k:
+            return nearest
+
+        # Parts as ranges of order, which the splits sort the cities into
+        order = np.arange(n)
+        parts = []
+        pending = [(0, n)]
+        while pending:
+            start, end = pending.pop()
+            if end - start <= 2 * (k + 1):
+                parts.append((start, end))
+                continue
+            members = order[start:end]
+            axis = np.ptp(points[members], axis=0).argmax()
+            half = (end - start) // 2
+            order[start:end] = members[np.argpartition(
+                points[members, axis], half)]
+            pending += [(start, start + half), (start + half, end)]
+        low = np.array([points[order[start:end]].min(axis=0)
+                        for start, end in parts])
+        high = np.array([points[order[start:end]].max(axis=0)
+                         for start, end in parts])
+
+        for i, (start, end) in enumerate(parts):
+            members = order[start:end]
+            dists, _ = _closest(points, members, members, k)
+            gap = np.maximum(np.maximum(low - high[i], low[i] - high), 0)
+            near = np.flatnonzero(np.sqrt((gap ** 2).sum(axis=1))
+                                  <= dists.max())
+            around = np.concatenate([order[parts[j][0]:parts[j][1]]
+                                     for j in near])
+            _, picks = _closest(points, members, around, k)
+            order_by = np.argsort(self.distance(members[:, None], picks), 1)
+            nearest[members] = np.take_along_axis(picks, order_by, 1)
+        return nearest
+
 
 class AntColony(object):
 
-    def __init__(self, distances, n_ants, n_best, n_iterations, decay, alpha=1, beta=1):
+    def __init__(self, distances, n_ants, n_best, n_iterations, decay, alpha=1, beta=1, n_candidates=None, workers=None, n_local_search=None, max_min=False, patience=None, min_branching=None, callback=None, seed=None):
         """
         Args:
-            distances (2D numpy.array): Square matrix of distances. Diagonal is assumed to be np.inf.
+            distances (2D numpy.array or Coordinates): Square matrix of distances. Diagonal is assumed to be np.inf. With Coordinates, pheromone is only kept for the edges to the candidates of each city
             n_ants (int): Number of ants running per iteration
             n_best (int): Number of best ants who deposit pheromone
             n_iteration (int): Number of iterations
             decay (float): Rate it which pheromone decays. The pheromone value is multiplied by decay, so 0.95 will lead to decay, 0.5 to much faster decay.
             alpha (int or float): exponenet on pheromone, higher alpha gives pheromone more weight. Default=1
             beta (int or float): exponent on distance, higher beta give distance more weight. Default=1
+            n_candidates (int): Number of nearest cities an ant chooses from, only looking further once all of them are visited. Default=None, all cities, or 10 with Coordinates
+            workers (int): Number of processes building the tours of each iteration in run. Default=None, all in the calling process
+            n_local_search (int): Number of best tours of every iteration improved with 2-opt and Or-opt moves before they deposit pheromone. Default=None, no local search
+            max_min (bool): MAX-MIN Ant System, where only the best ant of every iteration deposits 1 / its distance, and pheromone is kept between limits that depend on the shortest path so far. Needs decay < 1. Default=False
+            patience (int): Stop after this many iterations without a shorter path. Default=None, run all iterations
+            min_branching (float): Stop once the average number of cities an ant still chooses from, the 0.05-branching factor of the pheromone, drops below this. Default=None, run all iterations
+            callback (callable): Called after every iteration with a dict of its index (iteration), the shortest distance of the iteration (iteration_shortest) and so far (shortest), and the seconds spent building tours (construction), measuring them (evaluation) and updating pheromone (pheromone). Default=None, nothing is timed
+            seed (int or numpy.random.Generator): Seed of the random numbers of the colony. Runs with the same seed and number of workers give the same tours. Default=None, fresh entropy
 
         Example:
             ant_colony = AntColony(german_distances, 100, 20, 2000, 0.95, alpha=1, beta=2)          
         """
         self.distances  = distances
-        self.pheromone = np.ones(self.distances.shape) / len(distances)
-        self.all_inds = range(len(distances))
         self.n_ants = n_ants
         self.n_best = n_best
         self.n_iterations = n_iterations
         self.decay = decay
         self.alpha = alpha
         self.beta = beta
+        self.workers = workers
+        self.pool = None
+        self.n_local_search = n_local_search
+        self.max_min = max_min
+        self.patience = patience
+        self.min_branching = min_branching
+        self.callback = callback
+        self.rng = np.random.default_rng(seed)
+        # Root of the streams of the batches of ants built by workers, one
+        # per run, iteration and batch, so that they only depend on the seed
+        self.seed_seq = self.rng.bit_generator.seed_seq
+        self.tau_min = self.tau_max = None
+
+        # Progress of the runs so far, saved in checkpoints
+        self.runs = 0
+        self.iteration = 0
+        self.shortest_path = (None, np.inf)
+        self.stale = 0
+
+        # Nearest cities of every city, closest first
+        self.candidates = None
+        self.sparse = isinstance(distances, Coordinates)
+        if self.sparse:
+            if n_candidates is None:
+                n_candidates = 10
+            self.candidates = distances.nearest(
+                min(n_candidates, len(distances) - 1))
+        elif n_candidates is not None and n_candidates < len(distances) - 1:
+            self.candidates = _nearest(distances, n_candidates)
+
+        # Without a matrix, pheromone is only kept on the edges to the
+        # candidates, in the same layout. Every other edge has the same
+        # pheromone, which only ever evaporates.
+        if self.sparse:
+            self.pheromone = np.ones(self.candidates.shape) / len(distances)
+        else:
+            self.pheromone = np.ones(self.distances.shape) / len(distances)
+        self.rest_pheromone = 1.0 / len(distances)
+
+        # Cities the local search tries to connect every city to
+        self.neighbours = None
+        if n_local_search:
+            self.neighbours = self.candidates
+            if self.neighbours is None:
+                self.neighbours = _nearest(distances,
+                                           min(10, len(distances) - 1))
+
+        # Distance part of the scores, which never changes
+        if self.sparse:
+            rows = np.arange(len(distances))[:, None]
+            self.heuristic = (1.0 / distances[rows, self.candidates]) ** beta
+        else:
+            self.heuristic = (1.0 / distances) ** beta
+        self.scores = self.gen_scores()
+
+    def gen_scores(self, rows=None):
+        """
+        Returns the score of moving from the cities in rows (all of them by
+        default), pheromone ** alpha * (1.0 / distance) ** beta. With
+        candidate lists, this only covers the candidates of each city,
+        unless rows are given. With Coordinates, full rows are only right
+        for the cities outside the candidate lists.
+        """
+        if rows is not None and self.sparse:
+            return (self.rest_pheromone ** self.alpha
+                    * (1.0 / self.distances[rows]) ** self.beta)
+        if rows is not None:
+            return self.pheromone[rows] ** self.alpha * self.heuristic[rows]
+        if self.candidates is None or self.sparse:
+            return self.pheromone ** self.alpha * self.heuristic
+        rows = np.arange(len(self.distances))[:, None]
+        return (self.pheromone[rows, self.candidates] ** self.alpha
+                * self.heuristic[rows, self.candidates])
+
+    def run(self, time_budget=None, checkpoint=None, checkpoint_interval=10):
+        """
+        Runs all iterations, or as many as fit in time_budget seconds, and
+        returns the shortest path found as a list of (city, next city)
+        moves, with its distance.
+
+        With a checkpoint file, the colony is saved to it every
+        checkpoint_interval iterations and at the end. If the file already
+        exists, the run resumes from it, only doing the iterations left.
+        Otherwise the run starts over from the first iteration, only
+        keeping the pheromone of earlier runs.
+        """
+        deadline = None
+        if time_budget is not None:
+            deadline = time.perf_counter() + time_budget
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.load(checkpoint)
+        else:
+            self.runs += 1
+            self.iteration = 0
+            self.shortest_path = (None, np.inf)
+            self.stale = 0
+        with contextlib.ExitStack() as stack:
+            if self.workers is not None and self.workers > 1:
+                stack.enter_context(self.start_workers())
+            tour, dist = self.run_iterations(
+                self.n_iterations - self.iteration, deadline, checkpoint,
+                checkpoint_interval)
+        return self.tour_path(tour), dist
+
+    def run_iterations(self, n_iterations=None, deadline=None,
+                       checkpoint=None, checkpoint_interval=10):
+        """
+        Runs n_iterations (n_iterations of the colony by default) more
+        iterations, continuing from the current pheromone, and returns the
+        shortest tour found so far and its distance.
+
+        Once time.perf_counter() passes deadline, ants stop building tours
+        at once, the iteration in progress only keeps the tours finished by
+        then, and no more iterations start. Until the colony has a first
+        tour, its first batch of ants is built regardless.
+
+        With a checkpoint file, the colony is saved to it every
+        checkpoint_interval iterations and when the iterations stop.
+        """
+        if n_iterations is None:
+            n_iterations = self.n_iterations
+        # Only timed for the callback
+        timed = self.callback is not None
+        for i in range(n_iterations):
+            if timed:
+                start = time.perf_counter()
+            tours = self.gen_all_tours(deadline)
+            if not len(tours):
+                # No ant finished before the deadline
+                break
+            if timed:
+                built = time.perf_counter()
+            lengths = self.gen_path_dist(tours)
+            if timed:
+                measured = time.perf_counter()
+            self.spread_pheronome(tours, lengths, self.n_best)
+            best = lengths.argmin()
+            shortest_path = (tours[best].copy(), lengths[best])
+            if shortest_path[1] < self.shortest_path[1]:
+                self.shortest_path = shortest_path
+                self.stale = 0
+            else:
+                self.stale += 1
+            self.pheromone *= self.decay
+            self.rest_pheromone *= self.decay
+            if self.max_min:
+                self.limit_pheromone(self.shortest_path[1])
+
+            if timed:
+                self.callback({
+                    'iteration': self.iteration,
+                    'iteration_shortest': shortest_path[1],
+                    'shortest': self.shortest_path[1],
+                    'construction': built - start,
+                    'evaluation': measured - built,
+                    'pheromone': time.perf_counter() - measured,
+                })
+            self.iteration += 1
+            if (checkpoint is not None
+                    and self.iteration % checkpoint_interval == 0):
+                self.save(checkpoint)
+
+            if self.patience is not None and self.stale >= self.patience:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if (self.min_branching is not None
+                    and self.branching_factor() < self.min_branching):
+                break
+        if checkpoint is not None:
+            self.save(checkpoint)
+        return self.shortest_path
+
+    def save(self, filename):
+        """
+        Writes the pheromone, the shortest tour so far, the run and
+        iteration counts and the state and seed of the random numbers to filename, as an npz
+        archive.
+        The file is replaced at once, so that an interrupted save leaves the
+        previous checkpoint intact.
+        """
+        tour, dist = self.shortest_path
+        if tour is None:
+            tour = np.empty(0, dtype=np.int32)
+        limits = [np.nan, np.nan]
+        if self.tau_max is not None:
+            limits = [self.tau_min, self.tau_max]
+        with open(filename + '.tmp', 'wb') as f:
+            np.savez(f, pheromone=self.pheromone, tour=tour, dist=dist,
+                     rest=self.rest_pheromone, iteration=self.iteration,
+                     stale=self.stale, runs=self.runs, limits=limits,
+                     rng=json.dumps(self.rng.bit_generator.state),
+                     seed=json.dumps({
+                         'entropy': self.seed_seq.entropy,
+                         'spawn_key': self.seed_seq.spawn_key,
+                         'pool_size': self.seed_seq.pool_size}))
+        os.replace(filename + '.tmp', filename)
+
+    def load(self, filename):
+        """
+        Restores a colony saved by save, into a colony created with the same
+        distances and parameters.
+        """
+        with np.load(filename) as f:
+            if f['pheromone'].shape != self.pheromone.shape:
+                raise ValueError('%s holds a colony of %d cities, not %d'
+                                 % (filename, len(f['pheromone']),
+                                    len(self.pheromone)))
+            self.pheromone[...] = f['pheromone']
+            self.rest_pheromone = float(f['rest'])
+            tour = f['tour']
+            self.shortest_path = (tour if len(tour) else None, f['dist'][()])
+            self.iteration = int(f['iteration'])
+            self.stale = int(f['stale'])
+            self.runs = int(f['runs'])
+            if not np.isnan(f['limits']).any():
+                self.tau_min, self.tau_max = f['limits'].tolist()
+            self.rng.bit_generator.state = json.loads(str(f['rng']))
+            seed = json.loads(str(f['seed']))
+            self.seed_seq = np.random.SeedSequence(
+                seed['entropy'], spawn_key=seed['spawn_key'],
+                pool_size=seed['pool_size'])
+
+    def spread_pheronome(self, tours, lengths, n_best):
+        """
+        Deposits pheromone on the edges of the n_best shortest tours, 1 /
+        the distance of each edge. In MAX-MIN mode only the shortest tour
+        deposits, 1 / its distance on every edge.
+        """
+        if self.max_min:
+            n_best = 1
+        best = np.argsort(lengths, kind='stable')[:n_best]
+        moves = (tours[best].ravel(), np.roll(tours[best], -1, axis=1).ravel())
+        if self.max_min:
+            amount = 1.0 / np.repeat(np.asarray(lengths)[best], tours.shape[1])
+        else:
+            amount = 1.0 / self.distances[moves]
+        if self.sparse:
+            # Only edges to candidates keep their pheromone
+            match = self.candidates[moves[0]] == moves[1][:, None]
+            found = match.any(axis=1)
+            moves = (moves[0][found], match[found].argmax(axis=1))
+            amount = amount[found]
+        # add.at so that edges shared by several tours get every deposit
+        np.add.at(self.pheromone, moves, amount)
+
+    def limit_pheromone(self, shortest):
+        """
+        Clips the pheromone between the MAX-MIN limits for the shortest
+        distance so far. The first call sets all of it to the upper limit,
+        so that ants explore widely at first.
+        """
+        n = len(self.distances)
+        first = self.tau_max is None
+        self.tau_max = 1.0 / ((1 - self.decay) * shortest)
+        # Lower limit giving the best path a 0.05 chance to be rebuilt once
+        # the pheromone has converged
+        p = 0.05 ** (1.0 / n)
+        self.tau_min = min(self.tau_max * (1 - p) / (max(n / 2 - 1, 1) * p),
+                           self.tau_max)
+        if first:
+            self.pheromone[...] = self.tau_max
+            self.rest_pheromone = self.tau_max
+        else:
+            np.clip(self.pheromone, self.tau_min, self.tau_max,
+                    out=self.pheromone)
+            self.rest_pheromone = min(max(self.rest_pheromone, self.tau_min),
+                                      self.tau_max)
+
+    def branching_factor(self, spread=0.05):
+        """
+        Returns the average number of edges out of a city whose pheromone is
+        above the lowest value by at least spread times the pheromone range.
+        The range is the MAX-MIN limits once set, and the range of the
+        pheromone of each city otherwise. It falls towards 1 as the colony
+        converges.
+        """
+        if self.sparse:
+            # Only counting the candidates
+            finite = np.ones(self.pheromone.shape, dtype=bool)
+        else:
+            finite = np.isfinite(self.distances)
+        if self.tau_max is not None:
+            low, high = self.tau_min, self.tau_max
+        else:
+            pheromone = np.where(finite, self.pheromone, np.nan)
+            low = np.nanmin(pheromone, axis=1, keepdims=True)
+            high = np.nanmax(pheromone, axis=1, keepdims=True)
+        above = self.pheromone >= low + spread * (high - low)
+        return (above & finite).sum(axis=1).mean()
+
+    def gen_path_dist(self, tours):
+        """
+        Returns the distance of a tour, or of every row of a stack of tours,
+        going back to the first city at the end.
+        """
+        return self.distances[tours, np.roll(tours, -1, axis=-1)].sum(axis=-1)
+
+    def tour_path(self, tour):
+        """
+        Returns a tour as the list of (city, next city) moves that run
+        returns, empty without a tour.
+        """
+        if tour is None:
+            return []
+        tour = np.asarray(tour).tolist()
+        return list(zip(tour, tour[1:] + tour[:1]))
+
+    @contextlib.contextmanager
+    def start_workers(self):
+        """
+        Starts the worker processes building the tours in gen_all_tours,
+        until the end of the with block. Distances, pheromone and scores
+        are moved to shared memory meanwhile, so that workers see every
+        update without copying them.
+        """
+        shared = ['pheromone', 'heuristic', 'scores']
+        if self.candidates is not None:
+            shared.append('candidates')
+        if not self.sparse:
+            shared.append('distances')
+
+        blocks = []
+        try:
+            refs = {}
+            for name in shared:
+                array = np.asarray(getattr(self, name))
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(array.nbytes, 1))
+                blocks.append(shm)
+                view = np.ndarray(array.shape, dtype=array.dtype,
+                                  buffer=shm.buf)
+                view[...] = array
+                setattr(self, name, view)
+                refs[name] = (shm.name, array.shape, array.dtype)
+
+            # Workers get a copy of the colony without its arrays, which
+            # they map from shared memory instead
+            colony = copy.copy(self)
+            for name in shared:
+                setattr(colony, name, None)
+
+            with multiprocessing.Pool(self.workers, initializer=_attach,
+                                      initargs=(colony, refs)) as pool:
+                self.pool = pool
+                yield pool
+        finally:
+            self.pool = None
+            for name in shared:
+                setattr(self, name, np.array(getattr(self, name)))
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def gen_all_tours(self, deadline=None):
+        """
+        Returns the tours of all ants for this iteration, one row per ant,
+        after local search on the shortest of them. Past the deadline, only
+        the tours finished so far are returned, which may be none.
+        """
+        # Pheromone only changes between iterations
+        self.scores[...] = self.gen_scores()
+
+        if self.pool is None and deadline is None:
+            tours = self.gen_tours(0)
+        else:
+            # Split the colony between the workers, and with a deadline in
+            # many small batches, so that little is lost when it passes
+            n_batches = self.workers if self.pool is not None else 1
+            if deadline is not None:
+                n_batches *= 4
+            sizes = np.diff(np.linspace(0, self.n_ants, n_batches + 1)
+                            .astype(int))
+            sizes = sizes[sizes > 0]
+            deadlines = [deadline] * len(sizes)
+            if self.shortest_path[0] is None:
+                deadlines[0] = None
+            if self.pool is not None:
+                # Every batch gets its own stream, whichever worker builds it
+                seq = self.seed_seq
+                key = seq.spawn_key + (self.runs, self.iteration)
+                streams = [np.random.default_rng(np.random.SeedSequence(
+                    seq.entropy, spawn_key=key + (b,),
+                    pool_size=seq.pool_size)) for b in range(len(sizes))]
+                batches = [(size, rng, self.rest_pheromone, limit)
+                           for size, rng, limit in
+                           zip(sizes, streams, deadlines)]
+                batches = self.pool.imap(_gen_tours, batches)
+            else:
+                batches = (self.gen_tours(0, size, deadline=limit)
+                           for size, limit in zip(sizes, deadlines))
+
+            # Batches still running at the deadline are left behind, and
+            # stop at their next step
+            tours = []
+            for batch in batches:
+                if batch is not None:
+                    tours.append(batch)
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+            if not tours:
+                return np.empty((0, len(self.distances)), dtype=np.int32)
+            tours = np.concatenate(tours)
+
+        if self.n_local_search:
+            # Improve the shortest tours before they deposit pheromone
+            lengths = self.gen_path_dist(tours)
+            for ant in np.argsort(lengths)[:self.n_local_search]:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                tours[ant] = improve_tour(tours[ant], self.distances,
+                                          self.neighbours, deadline)
+        return tours
+
+    def gen_tours(self, start, n_ants=None, rng=None, deadline=None):
+        """
+        Builds the tours of all ants together, moving every ant one step at
+        a time.
+
+        Args:
+            start (int): City every tour starts from
+            n_ants (int): Number of tours to build. Default=None, n_ants
+            rng (numpy.random.Generator): Random numbers to build them with. Default=None, those of the colony
+            deadline (float): time.perf_counter() value after which the tours are given up. Default=None, no limit
+
+        Returns:
+            Array with one row per ant, listing the cities in the order it
+            visits them, from start, or None past the deadline.
+        """
+        n = len(self.distances)
+        if n_ants is None:
+            n_ants = self.n_ants
+        if rng is None:
+            rng = self.rng
+        tours = np.empty((n_ants, n), dtype=np.int32)
+        tours[:, 0] = start
+        visited = np.zeros((n_ants, n), dtype=bool)
+        ants = np.arange(n_ants)
+        for i in range(1, n):
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            prev = tours[:, i - 1]
+            visited[ants, prev] = True
+
+            if self.candidates is None:
+                rows = self.scores[prev]
+                rows[visited] = 0
+                tours[:, i] = _roulette(rows, rng)
+                continue
+
+            # Choose among the candidates not visited yet
+            candidates = self.candidates[prev]
+            taken = visited[ants[:, None], candidates]
+            rows = self.scores[prev]
+            rows[taken] = 0
+            moves = candidates[ants, _roulette(rows, rng)]
+
+            # and among all cities once there are none left
+            stuck = taken.all(axis=1)
+            if stuck.any():
+                rows = self.gen_scores(prev[stuck])
+                rows[visited[stuck]] = 0
+                moves[stuck] = _roulette(rows, rng)
+            tours[:, i] = moves
+        return tours
+
+
+def improve_tour(tour, distances, neighbours, deadline=None):
+    """
+    Improves a tour with 2-opt and Or-opt moves until none of them makes it
+    shorter. Moves only add edges from a city to one of its neighbours, and
+    cities whose moves all failed are skipped (don't-look bits) until an
+    edge next to them changes.
+
+    Args:
+        tour (numpy.array): Cities in the order they are visited
+        distances (2D numpy.array): Square matrix of distances, which may be asymmetric
+        neighbours (2D numpy.array): Cities each city may be connected to, one row per city
+        deadline (float): time.perf_counter() value after which no more moves are made. Default=None, no limit
+
+    Returns:
+        The improved tour, starting from the same city.
+    """
+    n = len(tour)
+    tour = np.asarray(tour)
+    first = tour[0]
+    if n < 5:
+        return tour.copy()
+    lengths = np.arange(1, 4)[:, None, None]
+
+    active = np.ones(n, dtype=bool)
+    while active.any():
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        pos = np.empty(n, dtype=np.intp)
+        pos[tour] = np.arange(n)
+        double = np.concatenate([tour, tour])
+        forward = np.concatenate(
+            [[0], np.cumsum(distances[double[:-1], double[1:]])])
+        backward = np.concatenate(
+            [[0], np.cumsum(distances[double[1:], double[:-1]])])
+        tolerance = 1e-9 * forward[n]
+
+        cities = np.flatnonzero(active)
+        near = neighbours[cities]
+        i = pos[cities][:, None]
+
+        # 2-opt: a -> c replaces a -> b and c -> d, reversing b ... c
+        j = pos[near]
+        j = np.where(j > i, j, j + n)
+        b = double[i + 1]
+        d = double[j + 1]
+        with np.errstate(invalid='ignore'):
+            two_opt = (distances[cities[:, None], near] + distances[b, d]
+                       - distances[cities[:, None], b] - distances[near, d]
+                       + backward[j] - backward[i + 1]
+                       - forward[j] + forward[i + 1])
+        two_opt[j - i < 2] = np.inf
+
+        # Or-opt: the segment of 1 to 3 cities ending at a moves in front
+        # of c, between e and c
+        seg = (i - lengths + 1) % n
+        before = tour[(seg - 1) % n]
+        start = tour[seg]
+        after = tour[(i + 1) % n]
+        e = tour[(pos[near] - 1) % n]
+        offset = (pos[near] - seg) % n
+        with np.errstate(invalid='ignore'):
+            or_opt = (distances[e, start] + distances[cities[:, None], near]
+                      + distances[before, after]
+                      - distances[before, start]
+                      - distances[cities[:, None], after]
+                      - distances[e, near])
+        or_opt[(offset <= lengths) | (lengths > n - 3)] = np.inf
+
+        best_two = np.nanmin(two_opt, axis=1, initial=np.inf)
+        best_or = np.nanmin(or_opt, axis=(0, 2), initial=np.inf)
+        improving = np.minimum(best_two, best_or) < -tolerance
+        active[cities[~improving]] = False
+        if not improving.any():
+            break
+
+        if best_two.min() <= best_or.min():
+            a, k = np.unravel_index(np.nanargmin(two_opt), two_opt.shape)
+            length = j[a, k] - i[a, 0]
+            seq = np.roll(tour, -(i[a, 0] + 1))
+            tour = np.concatenate([seq[:length][::-1], seq[length:]])
+            changed = [cities[a], b[a, 0], near[a, k], d[a, k]]
+        else:
+            l, a, k = np.unravel_index(np.nanargmin(or_opt), or_opt.shape)
+            length = l + 1
+            seq = np.roll(tour, -seg[l, a, 0])
+            rest = seq[length:]
+            at = offset[l, a, k] - length
+            tour = np.concatenate([rest[:at], seq[:length], rest[at:]])
+            changed = [before[l, a, 0], start[l, a, 0], cities[a],
+                       after[a, 0], e[a, k], near[a, k]]
+        active[changed] = True
+
+    return np.roll(tour, -int(np.flatnonzero(tour == first)[0]))
+
+
+def _nearest(distances, k):
+    """
+    Returns the k nearest cities of every city, closest first.
+    """
+    nearest = np.argpartition(distances, k, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(distances, nearest, 1), 1)
+    return np.take_along_axis(nearest, order, 1)
+
+
+def _closest(points, members, others, k, block=1 << 16):
+    """
+    Returns the distances and indices of the k points among others closest
+    to each of members, other than itself, one row per member. Distances
+    are computed for about block pairs at a time.
+    """
+    dists = np.full((len(members), k), np.inf)
+    picks = np.zeros((len(members), k), dtype=np.intp)
+    step = max(1, block // len(members))
+    for start in range(0, len(others), step):
+        chunk = others[start:start + step]
+        d = np.sqrt(((points[members, None] - points[chunk]) ** 2)
+                    .sum(axis=-1))
+        d[members[:, None] == chunk] = np.inf
+        d = np.concatenate([dists, d], axis=1)
+        ids = np.concatenate(
+            [picks, np.broadcast_to(chunk, (len(members), len(chunk)))],
+            axis=1)
+        best = np.argpartition(d, k - 1, axis=1)[:, :k]
+        dists = np.take_along_axis(d, best, 1)
+        picks = np.take_along_axis(ids, best, 1)
+    return dists, picks
+
+
+def _roulette(rows, rng):
+    """
+    Picks a column in every row of scores, with a probability proportional
+    to its score. Rows of all zero scores pick an arbitrary column.
+    """
+    # Roulette wheel: the first column whose cumulative score passes a
+    # uniform draw over the total score of the row
+    cumulative = np.cumsum(rows, axis=1)
+    draws = rng.random(len(rows)) * cumulative[:, -1]
+    picks = (cumulative <= draws[:, None]).sum(axis=1)
+
+    # A draw rounded up to the total selects the last column with a score
+    over = picks == rows.shape[1]
+    if over.any():
+        picks[over] = np.argmax(
+            cumulative[over] >= cumulative[over, -1:], axis=1)
+    return picks
+
+
+def run_islands(colonies, migration_interval=10):
+    """
+    Runs independent colonies in separate processes, each with its own
+    pheromone and parameters. Every migration_interval iterations, the
+    shortest path found by any colony so far is sent to all of them, which
+    deposit pheromone on it as if one of their best ants had walked it.
+
+    Args:
+        colonies (list of AntColony): Colonies to run, each for its own n_iterations
+        migration_interval (int): Number of iterations between migrations. Default=10
+
+    Returns:
+        The shortest path of all colonies, in the same form as AntColony.run.
+
+    Example:
+        shortest_path = run_islands([AntColony(distances, 25, 5, 200, 0.95, beta=b) for b in (1, 2, 3, 5)])
+    """
+    n_rounds = max(-(-colony.n_iterations // migration_interval)
+                   for colony in colonies)
+    shortest_path = (None, np.inf)
+    islands = []
+    try:
+        for colony in colonies:
+            conn, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_island, args=(colony, child, migration_interval))
+            process.start()
+            # Closed here so that a failing island shows up as EOFError
+            child.close()
+            islands.append((process, conn))
+
+        migrant = None
+        for i in range(n_rounds):
+            for process, conn in islands:
+                conn.send(migrant)
+            for process, conn in islands:
+                path = conn.recv()
+                if path[1] < shortest_path[1]:
+                    shortest_path = path
+            migrant = shortest_path
+    finally:
+        for process, conn in islands:
+            try:
+                conn.send(False)
+            except OSError:
+                pass
+            conn.close()
+        for process, conn in islands:
+            process.join()
+    tour, dist = shortest_path
+    return colonies[0].tour_path(tour), dist
+
+
+def _island(colony, conn, migration_interval):
+    shortest_path = (None, np.inf)
+    remaining = colony.n_iterations
+    with contextlib.ExitStack() as stack:
+        if colony.workers is not None and colony.workers > 1:
+            stack.enter_context(colony.start_workers())
+        while True:
+            migrant = conn.recv()
+            if migrant is False:
+                break
+            if migrant is not None and migrant[1] < shortest_path[1]:
+                shortest_path = migrant
+                tour, dist = migrant
+                colony.spread_pheronome(tour[None], [dist], 1)
+
+            n_iterations = min(migration_interval, remaining)
+            remaining -= n_iterations
+            if n_iterations > 0:
+                path = colony.run_iterations(n_iterations)
+                if path[1] < shortest_path[1]:
+                    shortest_path = path
+            conn.send(shortest_path)
+    conn.close()
+
+
+# Colony of a worker process, set up by _attach
+_worker = {}
+
 
-    def run(self):
-        shortest_path = None
-        all_time_shortest_path = ("placeholder", np.inf)
-        for i in range(self.n_iterations):
-            all_paths = self.gen_all_paths()
-            self.spread_pheronome(all_paths, self.n_best, shortest_path=shortest_path)
-            shortest_path = min(all_paths, key=lambda x: x[1])
-            print (shortest_path)
-            if shortest_path[1] < all_time_shortest_path[1]:
-                all_time_shortest_path = shortest_path            
-            self.pheromone * self.decay            
-        return all_time_shortest_path
-
-    def spread_pheronome(self, all_paths, n_best, shortest_path):
-        sorted_paths = sorted(all_paths, key=lambda x: x[1])
-        for path, dist in sorted_paths[:n_best]:
-            for move in path:
-                self.pheromone[move] += 1.0 / self.distances[move]
-
-    def gen_path_dist(self, path):
-        total_dist = 0
-        for ele in path:
-            total_dist += self.distances[ele]
-        return total_dist
-
-    def gen_all_paths(self):
-        all_paths = []
-        for i in range(self.n_ants):
-            path = self.gen_path(0)
-            all_paths.append((path, self.gen_path_dist(path)))
-        return all_paths
-
-    def gen_path(self, start):
-        path = []
-        visited = set()
-        visited.add(start)
-        prev = start
-        for i in range(len(self.distances) - 1):
-            move = self.pick_move(self.pheromone[prev], self.distances[prev], visited)
-            path.append((prev, move))
-            prev = move
-            visited.add(move)
-        path.append((prev, start)) # going back to where we started    
-        return path
-
-    def pick_move(self, pheromone, dist, visited):
-        pheromone = np.copy(pheromone)
-        pheromone[list(visited)] = 0
-
-        row = pheromone ** self.alpha * (( 1.0 / dist) ** self.beta)
-
-        norm_row = row / row.sum()
-        move = np_choice(self.all_inds, 1, p=norm_row)[0]
-        return move
+def _attach(colony, refs):
+    blocks = []
+    for name, (shm_name, shape, dtype) in refs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        setattr(colony, name, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    _worker.update(colony=colony, blocks=blocks)
 
 
+def _gen_tours(batch):
+    # perf_counter is the same system-wide clock in every process
+    n_ants, rng, _worker['colony'].rest_pheromone, deadline = batch
+    return _worker['colony'].gen_tours(0, n_ants, rng, deadline)
@@ -0,0 +1,176 @@
+"""
+Solves many instances over one pool of worker processes, which import the
+solvers once, and streams one JSON line per instance as soon as it is solved.
+Instances are read from a directory, one distance matrix file per instance in
+any format read_distances supports, or from a JSONL file ('-' for stdin) with
+one object per line:
+
+    {"name": "a", "distances": [[0, 2, 9], [1, 0, 6], [15, 7, 0]]}
+    {"name": "b", "file": "b.tsp", "solver": "ant_colony",
+     "options": {"iterations": 500}}
+    {"name": "c", "metric": "haversine",
+     "coordinates": [[48.85, 2.35], [51.51, -0.13], [52.52, 13.4]]}
+
+Instances of up to --max-exact nodes go to held_karp unless they name a
+solver, and bigger ones to AntColony.
+
+    $ python batch.py instances/ --workers 8 --output results.jsonl
+    $ python batch.py instances.jsonl --max-exact 12 > results.jsonl
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def instances(source):
+    """
+    Yields the instances of a directory or JSONL file as dicts, with a name
+    and either the distances or the file to read them from.
+    """
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path):
+                yield {'name': name, 'file': path}
+        return
+
+    if source == '-':
+        lines = contextlib.nullcontext(sys.stdin)
+    else:
+        lines = open(source)
+    with lines as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                instance = json.loads(line)
+                instance.setdefault('name', 'line-%d' % number)
+                yield instance
+
+
+def solve(instance, max_exact, options):
+    """
+    Solves an instance in a worker process, and returns its result as a
+    dict. Failures are reported in the result instead of raised, so that
+    one bad instance does not stop the batch.
+    """
+    from solvers import AntColony, Coordinates, held_karp, read_distances
+
+    result = {'name': instance['name']}
+    start = time.perf_counter()
+    try:
+        if 'file' in instance:
+            dists = np.asarray(read_distances(instance['file']))
+        elif 'coordinates' in instance:
+            dists = Coordinates(instance['coordinates'],
+                                instance.get('metric', 'euclidean'))
+        else:
+            dists = np.asarray(instance['distances'])
+        n = len(dists)
+        solver = instance.get('solver')
+        if solver is None:
+            solver = 'held_karp' if n <= max_exact else 'ant_colony'
+
+        if solver == 'held_karp':
+            cost, tour = held_karp(np.asarray(dists))
+        elif solver == 'ant_colony':
+            options = dict(options, **instance.get('options', {}))
+            distances = dists
+            if not isinstance(dists, Coordinates):
+                distances = dists.astype(np.float64)
+                np.fill_diagonal(distances, np.inf)
+            colony = AntColony(distances, options.pop('ants'),
+                               options.pop('best'), options.pop('iterations'),
+                               options.pop('decay'), **options)
+            path, cost = colony.run()
+            tour = [move[0] for move in path]
+        else:
+            raise ValueError('unknown solver %r' % solver)
+        result.update(n=n, solver=solver, cost=float(cost),
+                      tour=[int(i) for i in tour])
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def _start():
+    # Loaded once per worker instead of once per instance
+    import solvers
+
+
+async def run(source, out, workers, max_exact, options):
+    """
+    Solves every instance of source with workers processes, writing the
+    results to out in the order they finish. Returns the number of
+    instances solved and of failures.
+    """
+    loop = asyncio.get_running_loop()
+    solved = failed = 0
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_start) as pool:
+        pending = set()
+
+        def write(done):
+            nonlocal solved, failed
+            for future in done:
+                result = future.result()
+                solved += 1
+                failed += 'error' in result
+                out.write(json.dumps(result) + '\n')
+            out.flush()
+
+        for instance in instances(source):
+            # Only a few instances in flight per worker, so that long
+            # streams are not read into memory all at once
+            if len(pending) >= 2 * workers:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                write(done)
+            pending.add(loop.run_in_executor(pool, solve, instance,
+                                             max_exact, options))
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            write(done)
+    return solved, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Solve a batch of instances over a process pool.')
+    parser.add_argument('source', help="directory of instance files, or "
+                                       "JSONL file of instances, '-' for "
+                                       "stdin")
+    parser.add_argument('--output', metavar='FILE',
+                        help='write results to FILE instead of stdout')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--max-exact', type=int, default=16,
+                        help='largest instance to solve with Held-Karp')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--ants', type=int, default=20)
+    parser.add_argument('--best', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--decay', type=float, default=0.95)
+    parser.add_argument('--alpha', type=float, default=1)
+    parser.add_argument('--beta', type=float, default=2)
+    args = parser.parse_args()
+
+    options = {key: getattr(args, key) for key in
+               ('seed', 'ants', 'best', 'iterations', 'decay', 'alpha',
+                'beta')}
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        out = sys.stdout
+        if args.output:
+            out = stack.enter_context(open(args.output, 'w'))
+        solved, failed = asyncio.run(run(args.source, out, args.workers,
+                                         args.max_exact, options))
+    print('%d instances, %d failed, %.3fs'
+          % (solved, failed, time.perf_counter() - start), file=sys.stderr)
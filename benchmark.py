@@ -0,0 +1,139 @@
+"""
+Benchmark of Held-Karp against the ant colony on shared instances: the 4, 20
+and 21 node matrices of held-karp.py, and seeded random matrices of growing
+size. Every run happens in a fresh process, recording its wall time, peak
+memory, tour cost and gap to the optimum found by Held-Karp.
+
+    $ python benchmark.py --sizes 8 12 16 --json bench.json --csv bench.csv
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+FIELDS = ['instance', 'n', 'solver', 'seconds', 'peak_memory', 'cost',
+          'optimum', 'gap']
+
+
+def instances(sizes, seed):
+    """
+    Yields (name, distance matrix) pairs of the instances to solve.
+    """
+    from solvers import generate_distances
+
+    for n in (4, 20, 21):
+        yield 'matrix-%d' % n, np.array(generate_distances(n))
+
+    # Symmetric, with distances between 1 and 99 like the original
+    # generator of held-karp.py
+    for n in sizes:
+        rng = np.random.default_rng([seed, n])
+        dists = rng.integers(1, 100, size=(n, n))
+        dists = np.triu(dists, 1)
+        yield 'random-%d-%d' % (n, seed), dists + dists.T
+
+
+def run(solver, dists, options):
+    """
+    Solves in the current process, and returns the seconds taken, the peak
+    memory in bytes and the cost found.
+    """
+    from solvers import AntColony, held_karp
+
+    baseline = _max_rss()
+    start = time.perf_counter()
+    if solver == 'held_karp':
+        cost, path = held_karp(dists)
+    else:
+        distances = dists.astype(np.float64)
+        np.fill_diagonal(distances, np.inf)
+        colony = AntColony(distances, options['ants'], options['best'],
+                           options['iterations'], options['decay'],
+                           alpha=options['alpha'], beta=options['beta'],
+                           seed=options['seed'])
+        path, cost = colony.run()
+    seconds = time.perf_counter() - start
+    return seconds, _max_rss() - baseline, float(cost)
+
+
+def _max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def benchmark(sizes, seed, max_exact, options):
+    """
+    Runs both solvers on every instance, and returns one dict per run with
+    the keys in FIELDS.
+    """
+    # Fresh processes, so that peak memory is not inherited from earlier
+    # runs
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name, dists in instances(sizes, seed):
+        n = len(dists)
+        optimum = None
+        solvers = ['held_karp'] if n <= max_exact else []
+        for solver in solvers + ['ant_colony']:
+            with context.Pool(1) as pool:
+                seconds, memory, cost = pool.apply(run,
+                                                   (solver, dists, options))
+            if solver == 'held_karp':
+                optimum = cost
+            gap = None if optimum is None else (cost - optimum) / optimum
+            results.append(dict(zip(FIELDS, [
+                name, n, solver, seconds, memory, cost, optimum, gap])))
+            print('%-16s %-10s %9.3fs %8.1f MB %10g %s'
+                  % (name, solver, seconds, memory / 2**20, cost,
+                     '' if gap is None else '%+.2f%%' % (100 * gap)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark Held-Karp against the ant colony.')
+    parser.add_argument('--sizes', type=int, nargs='*',
+                        default=[6, 8, 10, 12, 14, 16, 18],
+                        help='sizes of the random instances')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-exact', type=int, default=21,
+                        help='largest instance to solve with Held-Karp')
+    parser.add_argument('--ants', type=int, default=20)
+    parser.add_argument('--best', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--decay', type=float, default=0.95)
+    parser.add_argument('--alpha', type=float, default=1)
+    parser.add_argument('--beta', type=float, default=2)
+    parser.add_argument('--json', metavar='FILE', help='write results as JSON')
+    parser.add_argument('--csv', metavar='FILE', help='write results as CSV')
+    args = parser.parse_args()
+
+    options = {key: getattr(args, key) for key in
+               ('seed', 'ants', 'best', 'iterations', 'decay', 'alpha',
+                'beta')}
+    results = benchmark(args.sizes, args.seed, args.max_exact, options)
+
+    if args.json:
+        meta = {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'options': options,
+            'max_exact': args.max_exact,
+        }
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
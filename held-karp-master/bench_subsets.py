@@ -0,0 +1,60 @@
+"""
+Microbenchmark of the time spent per subset on enumerating the layers of
+Held-Karp, without relaxing them:
+
+    $ python bench_subsets.py 21
+
+combinations: itertools.combinations, rebuilding the mask bit by bit, as the
+    original implementation did
+unrank: unranking batches of consecutive ranks with the combinatorial
+    number system
+gosper: the lanes of Gosper's hack used by held_karp
+"""
+import importlib.util
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+spec = importlib.util.spec_from_file_location(
+    'held_karp', os.path.join(os.path.dirname(__file__), 'held-karp.py'))
+hk = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(hk)
+
+
+def combinations(size, subset_size, binom):
+    for subset in itertools.combinations(range(size), subset_size):
+        bits = 0
+        for bit in subset:
+            bits |= 1 << bit
+
+
+def unrank(size, subset_size, binom):
+    count = binom[size, subset_size]
+    for start in range(0, count, hk.BATCH_SIZE):
+        ranks = np.arange(start, min(start + hk.BATCH_SIZE, count))
+        subsets = hk._unrank(ranks, subset_size, binom)
+        np.bitwise_or.reduce(1 << subsets, axis=1)
+
+
+def gosper(size, subset_size, binom):
+    count = binom[size, subset_size]
+    for ranks, subsets in hk._subsets(0, count, subset_size, binom):
+        pass
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 21
+    size = n - 1
+    binom = hk._binomials(size)
+    states = sum(binom[size, s] for s in range(2, size + 1))
+
+    for enumerate_layer in (combinations, unrank, gosper):
+        start = time.perf_counter()
+        for subset_size in range(2, size + 1):
+            enumerate_layer(size, subset_size, binom)
+        elapsed = time.perf_counter() - start
+        print('%-12s %8.3fs %8.1f ns/subset'
+              % (enumerate_layer.__name__, elapsed, elapsed / states * 1e9))
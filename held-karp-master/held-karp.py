@@ -1,73 +1,855 @@
-import itertools
+import argparse
+import contextlib
+import math
+import multiprocessing
+import os
 import random
-import sys
+import re
+import struct
+import tempfile
 import time 
+import zipfile
+from multiprocessing import shared_memory
 
+import numpy as np
 
 
-def held_karp(dists):
+# Number of subsets relaxed together in one vectorized step. Bounds the size
+# of the temporary arrays built while processing a layer.
+BATCH_SIZE = 1 << 16
+
+# Seconds per step of the relaxation, one (subset, last node, previous node)
+# triple, on a single core. Only used by estimate.
+STEP_SECONDS = 1e-8
+
+# Steps of the relaxation that updating one changed candidate of a layer
+# costs, in IncrementalHeldKarp. Layers with more changed candidates than
+# the relaxation has steps over this are relaxed again in full instead.
+UPDATE_STEPS = 10
+
+# Number of rows of a matrix computed at once from TSPLIB coordinates
+_ROWS = 1 << 10
+
+
+def held_karp(dists, workers=None, spill=None, max_memory=None,
+              checkpoint=None, checkpoint_interval=600):
     """
     Implementation of Held-Karp, an algorithm that solves the Traveling
     Salesman Problem using dynamic programming with memoization.
 
     Parameters:
         dists: distance matrix
+        workers: number of processes sharing the work on each layer of
+            subsets. By default everything runs in the calling process.
+        spill: directory to write parent pointers to, instead of keeping
+            them in memory. The path is recovered from the file at the end.
+        max_memory: limit in bytes on the memory used for the tables. A
+            MemoryError is raised if they do not fit.
+        checkpoint: file to save the costs of the last completed layer
+            to, at most every checkpoint_interval seconds and after the last
+            layer. The parents of every layer are appended to the file
+            checkpoint + '.parents' as soon as the layer completes. If it
+            exists, the solve resumes after the layers it holds.
 
     Returns:
         A tuple, (cost, path).
     """
+    dists = np.asarray(dists)
     n = len(dists)
+    size = n - 1
+    dtype = np.int64 if np.issubdtype(dists.dtype, np.integer) else np.float64
+
+    entries, resident = _tables(size, dtype, spill)
+    largest = max(entries)
+
+    batch_size = BATCH_SIZE
+    if max_memory is not None:
+        if resident > max_memory:
+            raise MemoryError('%d nodes need %d bytes for the tables'
+                              % (n, resident))
+        batch_size = max(1, min(BATCH_SIZE,
+                                (max_memory - resident) // _per_subset(size)))
+
+    parallel = workers is not None and workers > 1
+    with contextlib.ExitStack() as stack:
+        # With several workers, every table is mapped into all processes
+        costs, refs = zip(*[_allocate(stack, largest, dtype, parallel)
+                            for _ in range(2)])
+        parent, parent_ref = _allocate(stack, sum(entries), np.uint8,
+                                       parallel, spill)
+        layers = _Layers(dists[1:, 1:], costs, parent, batch_size)
+
+        # Set transition cost from initial state
+        layers.cost(1)[:, 0] = dists[0, 1:]
+        layers.parent(1)[:] = 0
+
+        if parallel:
+            pool = stack.enter_context(multiprocessing.Pool(
+                workers, initializer=_attach,
+                initargs=(dists[1:, 1:], refs + (parent_ref,), batch_size)))
+
+        done = 1
+        if checkpoint is not None:
+            if os.path.exists(checkpoint):
+                done = _load_layers(checkpoint, dists, layers)
+            else:
+                _save_parents(checkpoint, layers, 1)
+        saved = time.time()
+
+        # Iterate subsets of increasing length and store intermediate results
+        # in classic dynamic programming manner. Each layer only depends on
+        # the previous one, so a whole batch of subsets is relaxed at once.
+        for subset_size in range(done + 1, size + 1):
+            count = math.comb(size, subset_size)
+            if not parallel:
+                layers.relax(subset_size, 0, count)
+            else:
+                # Hand out a few ranges per worker to even out the load.
+                # Every range of the layer must be done before the next
+                # layer starts.
+                step = -(-count // (4 * workers))
+                ranges = [(subset_size, start, min(start + step, count))
+                          for start in range(0, count, step)]
+                for _ in pool.imap_unordered(_relax_shared, ranges):
+                    pass
+
+            if checkpoint is not None:
+                _save_parents(checkpoint, layers, subset_size)
+                if (subset_size == size
+                        or time.time() - saved >= checkpoint_interval):
+                    _save_layers(checkpoint, dists, layers, subset_size)
+                    saved = time.time()
+
+        res = layers.backtrack(dists[1:, 0])
+
+        # Views must be released before shared memory can be closed
+        del layers, costs, parent
+    return res
+
+
+def estimate(n, dtype=np.float64, spill=None):
+    """
+    Estimates the time and memory held_karp takes on n nodes, without
+    running it.
+
+    Parameters:
+        n: number of nodes
+        dtype: type of the distances
+        spill: as in held_karp
+
+    Returns:
+        A tuple, (seconds, bytes).
+    """
+    size = max(n - 1, 0)
+    entries, resident = _tables(size, dtype, spill)
+    # Sum of comb(size, s) * s * s over the layers
+    steps = size * (size + 1) * 2 ** size // 4
+    try:
+        seconds = steps * STEP_SECONDS
+    except OverflowError:
+        seconds = math.inf
+    batch = min(BATCH_SIZE, max(entries) or 1) * _per_subset(size)
+    return seconds, resident + batch
+
+
+def _tables(size, dtype, spill):
+    """
+    Returns the number of entries of each layer of subsets, and the bytes
+    the tables take in memory.
+    """
+    # Only the costs of the current and the previous layer are kept, while
+    # parents are kept for every layer to backtrack at the end.
+    entries = [math.comb(size, s) * s for s in range(size + 1)]
+    resident = 2 * max(entries) * np.dtype(dtype).itemsize
+    if spill is None:
+        resident += sum(entries)
+    return entries, resident
+
+
+def _per_subset(size):
+    # Node indices, ranks and candidate costs of a subset
+    return 8 * size * 8
+
+
+class _Layers(object):
+    """
+    DP tables of Held-Karp, one layer of subsets of the same size at a time.
+
+    Node 0 is the fixed start, so subsets only range over nodes 1..n-1,
+    numbered from 0 here. The subsets of a layer are stored one row each, at
+    their rank in the combinatorial number system, and with a column for
+    each node of the subset in increasing order. A cost entry is the lowest
+    cost to reach that node after visiting the subset, and a parent entry
+    is the node visited right before it.
+
+    Layers cycle through the flat arrays in costs, so that with two arrays
+    only the costs of the last two layers are kept, and with one array per
+    layer all of them are. Parents of all layers follow each other in the
+    flat array parent.
+    """
+
+    def __init__(self, dists, costs, parent, batch_size=BATCH_SIZE):
+        self.dists = dists
+        self.batch_size = batch_size
+        self.size = len(dists)
+        self.costs = costs
+        self.parents = parent
+        self.binom = _binomials(self.size)
+        # Parents of layer s start at offsets[s - 1]
+        self.offsets = np.cumsum(
+            [0] + [self.binom[self.size, s] * s for s in range(1, self.size)])
+
+    def cost(self, subset_size):
+        count = self.binom[self.size, subset_size]
+        flat = self.costs[subset_size % len(self.costs)][:count * subset_size]
+        return flat.reshape(count, subset_size)
+
+    def parent(self, subset_size):
+        start = self.offsets[subset_size - 1]
+        flat = self.parents[start:start + self.binom[self.size, subset_size]
+                            * subset_size]
+        return flat.reshape(-1, subset_size)
+
+    def relax(self, subset_size, start, end):
+        """
+        Fills in the rows start..end of a layer from the previous layer.
+        """
+        prev_cost = self.cost(subset_size - 1)
+        cost = self.cost(subset_size)
+        parent = self.parent(subset_size)
+
+        for ranks, subsets in _subsets(start, end, subset_size, self.binom,
+                                       self.batch_size):
+            rows = np.arange(len(ranks))
+            prev = self.removed(subsets)
+
+            for i in range(subset_size):
+                k = subsets[:, i]
+                others = np.delete(subsets, i, axis=1)
+
+                # The row of the previous subset lists the costs for the
+                # other nodes in the same order
+                res = prev_cost[prev[:, i]] + self.dists[others, k[:, None]]
+                best = res.argmin(axis=1)
+                cost[ranks, i] = res[rows, best]
+                parent[ranks, i] = others[rows, best] + 1
+
+    def update(self, subset_size, changed, edges):
+        """
+        Updates the entries of a layer after some distances changed, and
+        returns the flat indices, row * subset_size + column, of the entries
+        whose cost changed.
+
+        changed holds the flat indices of the entries of the previous layer
+        whose cost changed, and edges lists the changed (m, k) distances
+        between nodes 1..n-1. Either one changes the candidate through m of
+        some entries for k. A candidate that got cheaper only replaces the
+        stored one where it wins, and the entry is only recomputed in full
+        where the candidate it was reached through got more expensive.
+        """
+        size = self.size
+        prev_cost = self.cost(subset_size - 1)
+        cost = self.cost(subset_size).reshape(-1)
+        parent = self.parent(subset_size).reshape(-1)
+        prev_cols = np.arange(subset_size - 1)
+
+        # Past a point it is cheaper to relax the whole layer again, and
+        # compare it to the old costs
+        candidates = len(changed) * (size - subset_size + 1) \
+            + len(edges) * self.binom[size - 2, subset_size - 2] * subset_size
+        if candidates * UPDATE_STEPS > len(cost) * (subset_size - 1):
+            old = cost.copy()
+            self.relax(subset_size, 0, self.binom[size, subset_size])
+            return np.flatnonzero(cost != old)
+
+        # Entries to recompute, and candidates beating the stored ones as
+        # (entry, node, cost) triples, found before any entry changes. The
+        # candidates through m beat the stored ones where they are cheaper,
+        # or as cheap through a lower node like in relax. Entries reached
+        # through a candidate that got more expensive are recomputed.
+        redo = []
+        found = []
+
+        def compare(entry, m, res):
+            stored = parent[entry].astype(np.intp) - 1
+            redo.append(entry[(m == stored) & (res > cost[entry])])
+            wins = (res < cost[entry]) | ((res == cost[entry]) & (m < stored))
+            found.append((entry[wins], m[wins], res[wins]))
+
+        step = max(1, self.batch_size // size)
+        for start in range(0, len(changed), step):
+            flat = changed[start:start + step]
+            ranks, cols = np.divmod(flat, subset_size - 1)
+            subsets = _unrank(ranks, subset_size - 1, self.binom)
+            rows = np.arange(len(flat))
+            m = subsets[rows, cols]
+
+            # Every node k outside of the subset gets a candidate through m.
+            # Adding k leaves the rank terms of the nodes below it, and moves
+            # the ones above it up a column.
+            member = np.zeros((len(flat), size), dtype=bool)
+            member[rows[:, None], subsets] = True
+            below = np.cumsum(member, axis=1) - member
+            up = self.binom[subsets, prev_cols + 2] \
+                - self.binom[subsets, prev_cols + 1]
+            above = np.zeros((len(flat), subset_size), dtype=np.int64)
+            above[:, :-1] = np.cumsum(up[:, ::-1], axis=1)[:, ::-1]
+
+            rows, k = np.nonzero(~member)
+            col = below[rows, k]
+            entry = (ranks[rows] + above[rows, col] + self.binom[k, col + 1]) \
+                * subset_size + col
+            compare(entry, m[rows],
+                    prev_cost[ranks[rows], cols[rows]]
+                    + self.dists[m[rows], k])
+
+        if edges:
+            binom = _binomials(size - 2)
+            terms = np.arange(1, subset_size + 1)
+        for m, k in edges:
+            # Subsets holding both nodes are the other nodes' subsets of two
+            # fewer nodes, with m and k added
+            rest = np.delete(np.arange(size), [m, k])
+            if subset_size == 2:
+                batches = [np.empty((1, 0), dtype=np.intp)]
+            else:
+                batches = (others for _, others in _subsets(
+                    0, binom[size - 2, subset_size - 2], subset_size - 2,
+                    binom, self.batch_size))
+            for others in batches:
+                subsets = np.sort(np.concatenate(
+                    [rest[others], np.full((len(others), 2), [m, k])],
+                    axis=1), axis=1)
+                rows = np.arange(len(subsets))
+                col = (subsets < k).sum(axis=1)
+                ranks = self.binom[subsets, terms].sum(axis=1)
+                prev = self.removed(subsets)[rows, col]
+                prev_col = (subsets < m).sum(axis=1) - (k < m)
+                compare(ranks * subset_size + col, np.full(len(rows), m),
+                        prev_cost[prev, prev_col] + self.dists[m, k])
+
+        marked = np.zeros(len(cost), dtype=bool)
+        for entry in redo:
+            marked[entry] = True
+        redo = np.flatnonzero(marked)
+        if found:
+            entry, m, res = (np.concatenate(x) for x in zip(*found))
+        else:
+            entry = m = res = np.empty(0, dtype=np.int64)
+        keep = ~marked[entry]
+        entry, m, res = entry[keep], m[keep], res[keep]
+        first = np.lexsort((m, res, entry))
+        first = first[np.diff(entry[first], prepend=-1) != 0]
+        entry, m, res = entry[first], m[first], res[first]
+        updated = [entry[res != cost[entry]]]
+        cost[entry] = res
+        parent[entry] = m + 1
+
+        for start in range(0, len(redo), self.batch_size):
+            flat = redo[start:start + self.batch_size]
+            ranks, i = np.divmod(flat, subset_size)
+            subsets = _unrank(ranks, subset_size, self.binom)
+            rows = np.arange(len(flat))
+            k = subsets[rows, i]
+            others = subsets[np.arange(subset_size) != i[:, None]]
+            others = others.reshape(-1, subset_size - 1)
+
+            res = prev_cost[self.removed(subsets)[rows, i]] \
+                + self.dists[others, k[:, None]]
+            best = res.argmin(axis=1)
+            updated.append(flat[cost[flat] != res[rows, best]])
+            cost[flat] = res[rows, best]
+            parent[flat] = others[rows, best] + 1
+        return np.concatenate(updated)
+
+    def removed(self, subsets):
+        """
+        Returns the ranks of the given subsets with each one of their nodes
+        removed in turn, as an array of the same shape.
+        """
+        # The nodes below the removed one keep their terms of the rank, the
+        # ones above it move down one.
+        cols = np.arange(subsets.shape[1])
+        below = self.binom[subsets, cols + 1]
+        above = self.binom[subsets, cols]
+        prev = np.cumsum(below, axis=1) - below
+        prev += np.cumsum(above[:, ::-1], axis=1)[:, ::-1] - above
+        return prev
+
+    def backtrack(self, back):
+        """
+        Returns the optimal (cost, path), given the costs back to node 0.
+        """
+        # Calculate optimal cost
+        res = self.cost(self.size)[0] + back
+        last = int(res.argmin()) + 1
+        opt = res[last - 1]
+
+        # Backtrack to find full path
+        bits = (1 << self.size) - 1
+        path = []
+        for subset_size in range(self.size, 0, -1):
+            path.append(last)
+            col = bin(bits & ((1 << (last - 1)) - 1)).count('1')
+            row = _rank(bits)
+            bits &= ~(1 << (last - 1))
+            last = int(self.parent(subset_size)[row, col])
+
+        # Add implicit start state
+        path.append(0)
+
+        return opt.item(), list(reversed(path))
+
+
+class IncrementalHeldKarp(object):
+    """
+    Held-Karp keeping the costs of all layers between solves, so that after
+    a few distances change only the entries that can be affected are
+    recomputed.
+
+    Example:
+        solver = IncrementalHeldKarp(dists)
+        cost, path = solver.solve()
+        cost, path = solver.update({(2, 5): 17, (5, 2): 17})
+    """
+
+    def __init__(self, dists):
+        """
+        Args:
+            dists: distance matrix. It is copied, and only changes through
+                update. Integer distances switch to floats the first time
+                update is given a distance that is not a whole number.
+        """
+        self.dists = np.array(dists)
+        self.size = len(self.dists) - 1
+        self.dtype = np.int64 if np.issubdtype(self.dists.dtype, np.integer) \
+            else np.float64
+        self.layers = None
+
+    def solve(self):
+        """
+        Solves from scratch and keeps the table.
+
+        Returns:
+            A tuple, (cost, path).
+        """
+        size = self.size
+        costs = [np.empty(math.comb(size, s) * s, dtype=self.dtype)
+                 for s in range(size + 1)]
+        parent = np.empty(sum(len(c) for c in costs), dtype=np.uint8)
+        self.layers = _Layers(self.dists[1:, 1:], costs, parent)
+
+        # Set transition cost from initial state
+        self.layers.cost(1)[:, 0] = self.dists[0, 1:]
+        self.layers.parent(1)[:] = 0
+
+        for subset_size in range(2, size + 1):
+            self.layers.relax(subset_size, 0, math.comb(size, subset_size))
+        return self.layers.backtrack(self.dists[1:, 0])
+
+    def update(self, changes):
+        """
+        Changes some distances and solves again, reusing the table of the
+        previous solve.
+
+        Args:
+            changes: dict mapping edges (i, j) to their new distance
+
+        Returns:
+            A tuple, (cost, path).
+        """
+        if self.dtype == np.int64 and not all(
+                float(dist).is_integer() for dist in changes.values()):
+            # Stored as is, the new distances would be truncated
+            self.dists = self.dists.astype(np.float64)
+            self.dtype = np.float64
+            if self.layers is not None:
+                self.layers.dists = self.dists[1:, 1:]
+                self.layers.costs = [c.astype(np.float64)
+                                     for c in self.layers.costs]
+
+        if self.layers is None:
+            for (i, j), dist in changes.items():
+                self.dists[i, j] = dist
+            return self.solve()
+
+        edges = []
+        changed = []
+        for (i, j), dist in changes.items():
+            if self.dists[i, j] == dist or i == j:
+                continue
+            self.dists[i, j] = dist
+            if i == 0:
+                # Only the transition cost from the initial state, entry
+                # j - 1 of the first layer
+                self.layers.cost(1)[j - 1, 0] = dist
+                changed.append(j - 1)
+            elif j != 0:
+                edges.append((i - 1, j - 1))
+            # Edges back to node 0 are only used by the final step
+
+        changed = np.array(changed, dtype=np.int64)
+        for subset_size in range(2, self.size + 1):
+            if not edges and not len(changed):
+                break
+            changed = self.layers.update(subset_size, changed, edges)
+        return self.layers.backtrack(self.dists[1:, 0])
+
+
+def _save_parents(filename, layers, subset_size):
+    """
+    Appends the parents of a completed layer to the parents file of a
+    checkpoint, starting the file over with the first layer. Every layer is
+    only written once.
+    """
+    with open(filename + '.parents', 'wb' if subset_size == 1 else 'ab') as f:
+        layers.parent(subset_size).tofile(f)
+
+
+def _save_layers(filename, dists, layers, subset_size):
+    """
+    Writes the costs of the last completed layer to filename, as an npz
+    archive. The file is replaced at once, so that an interrupted save
+    leaves the previous checkpoint intact. The parents up to that layer are
+    already in the parents file.
+    """
+    with open(filename + '.tmp', 'wb') as f:
+        np.savez(f, dists=dists, subset_size=subset_size,
+                 costs=layers.cost(subset_size))
+    os.replace(filename + '.tmp', filename)
+
+
+def _load_layers(filename, dists, layers):
+    """
+    Restores the layers saved by _save_layers and _save_parents, and returns
+    the size of the subsets of the last one. Parents of layers completed
+    after the last save are dropped from the parents file, to be appended
+    again.
+    """
+    with np.load(filename) as f:
+        if not np.array_equal(f['dists'], dists):
+            raise ValueError('%s was saved for other distances' % filename)
+        subset_size = int(f['subset_size'])
+        layers.cost(subset_size)[...] = f['costs']
+
+    end = layers.offsets[subset_size - 1] + layers.parent(subset_size).size
+    with open(filename + '.parents', 'r+b') as f:
+        if f.readinto(layers.parents[:end]) != end:
+            raise ValueError('%s.parents is missing layers' % filename)
+        f.truncate(end)
+    return subset_size
+
+
+def _binomials(size):
+    """
+    Returns a table of the binomial coefficients C(p, i) for p and i up to
+    size, plus a zero column for i = size + 1.
+    """
+    binom = np.zeros((size + 1, size + 2), dtype=np.int64)
+    for p in range(size + 1):
+        for i in range(p + 1):
+            binom[p, i] = math.comb(p, i)
+    return binom
+
+
+def _rank(bits):
+    """
+    Returns the rank of a subset among the subsets of the same size, in the
+    combinatorial number system. It sums C(p, i) over the set bits, where p
+    is the position of the bit and i its count from the lowest one.
+    Ranks follow the numerical order of the masks.
+    """
+    rank = 0
+    i = 0
+    while bits:
+        low = bits & -bits
+        i += 1
+        rank += math.comb(low.bit_length() - 1, i)
+        bits ^= low
+    return rank
+
+
+def _unrank(ranks, subset_size, binom):
+    """
+    Returns the subsets with the given ranks, as an array with one row of
+    node indices in increasing order per subset.
+    """
+    ranks = ranks.copy()
+    subsets = np.empty((len(ranks), subset_size), dtype=np.intp)
+
+    # The highest node is the largest p with C(p, i) not above the rank
+    for i in range(subset_size, 0, -1):
+        p = np.searchsorted(binom[:, i], ranks, side='right') - 1
+        subsets[:, i - 1] = p
+        ranks -= binom[p, i]
+    return subsets
+
+
+def _subsets(start, end, subset_size, binom, lanes=BATCH_SIZE):
+    """
+    Yields the subsets with ranks start..end of a layer, at most lanes at a
+    time, as pairs of arrays (ranks, subsets) with one row of node indices
+    in increasing order per subset. The arrays are overwritten by the next
+    step, so they must be used before advancing.
+
+    The ranks are split into runs of consecutive ranks, one per lane. Every
+    lane starts from an unranked subset, then all lanes step to their next
+    mask together with Gosper's hack, and the nodes of the masks are read
+    off lowest set bit first.
+    """
+    count = end - start
+    lanes = min(lanes, count)
+    if not lanes:
+        return
+
+    # The first extra lanes are one step longer than the others
+    length, extra = divmod(count, lanes)
+    lane = np.arange(lanes)
+    ranks = start + lane * length + np.minimum(lane, extra)
+    masks = np.bitwise_or.reduce(1 << _unrank(ranks, subset_size, binom),
+                                 axis=1)
+
+    nodes = np.empty((subset_size, lanes), dtype=np.intp)
+    low = np.empty(lanes, dtype=np.int64)
+    rest = np.empty(lanes, dtype=np.int64)
+    position = np.empty(lanes)
+    for step in range(length + bool(extra)):
+        active = lanes if step < length else extra
+
+        np.copyto(rest, masks)
+        for i in range(subset_size):
+            np.negative(rest, out=low)
+            np.bitwise_and(low, rest, out=low)
+            np.bitwise_xor(rest, low, out=rest)
+
+            # Exact, as low is a power of two
+            np.log2(low, out=position)
+            np.copyto(nodes[i], position, casting='unsafe')
+        yield ranks[:active], nodes[:, :active].T
+
+        # Next mask with as many bits set: move the lowest run of set bits
+        # up by one, and shift the rest of the run down to the bottom
+        np.negative(masks, out=low)
+        np.bitwise_and(low, masks, out=low)
+        np.add(masks, low, out=rest)
+        np.bitwise_xor(masks, rest, out=masks)
+        np.right_shift(masks, 2, out=masks)
+        np.floor_divide(masks, low, out=masks)
+        np.bitwise_or(masks, rest, out=masks)
+        ranks += 1
+
+
+def _allocate(stack, size, dtype, shared=False, spill=None):
+    """
+    Returns a flat array of size entries and a reference to it for _open.
+    The array lives in a temporary file in spill if given, in shared memory
+    if shared is true, and in memory otherwise. stack releases it.
+    """
+    if spill is not None:
+        f = stack.enter_context(tempfile.NamedTemporaryFile(dir=spill))
+        array = np.memmap(f.name, dtype=dtype, mode='w+', shape=max(size, 1))
+        return array, ('file', f.name, size, dtype)
 
-    # Maps each subset of the nodes to the cost to reach that subset, as well
-    # as what node it passed before reaching this subset.
-    # Node subsets are represented as set bits.
-    C = {}
-
-    # Set transition cost from initial state
-    for k in range(1, n):
-        C[(1 << k, k)] = (dists[0][k], 0)
-
-    # Iterate subsets of increasing length and store intermediate results
-    # in classic dynamic programming manner
-    for subset_size in range(2, n):
-        for subset in itertools.combinations(range(1, n), subset_size):
-            # Set bits for all nodes in this subset
-            bits = 0
-            for bit in subset:
-                bits |= 1 << bit
-
-            # Find the lowest cost to get to this subset
-            for k in subset:
-                prev = bits & ~(1 << k)
-
-                res = []
-                for m in subset:
-                    if m == 0 or m == k:
-                        continue
-                    res.append((C[(prev, m)][0] + dists[m][k], m))
-                C[(bits, k)] = min(res)
-
-    # We're interested in all bits but the least significant (the start state)
-    bits = (2**n - 1) - 1
-
-    # Calculate optimal cost
-    res = []
-    for k in range(1, n):
-        res.append((C[(bits, k)][0] + dists[k][0], k))
-    opt, parent = min(res)
-
-    # Backtrack to find full path
-    path = []
-    for i in range(n - 1):
-        path.append(parent)
-        new_bits = bits & ~(1 << parent)
-        _, parent = C[(bits, parent)]
-        bits = new_bits
-
-    # Add implicit start state
-    path.append(0)
-
-    return opt, list(reversed(path))
+    if shared:
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(size * np.dtype(dtype).itemsize, 1))
+        stack.callback(_release, shm)
+        array = np.ndarray(size, dtype=dtype, buffer=shm.buf)
+        return array, ('shm', shm.name, size, dtype)
+
+    return np.empty(size, dtype=dtype), None
+
+
+def _release(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # Still in use by a view that an exception is holding on to. It is
+        # unmapped once the view goes away.
+        pass
+    shm.unlink()
+
+
+def _open(ref):
+    """
+    Maps an array allocated by _allocate into this process. Returns the
+    array and the handle keeping it mapped.
+    """
+    kind, name, size, dtype = ref
+    if kind == 'file':
+        array = np.memmap(name, dtype=dtype, mode='r+', shape=max(size, 1))
+        return array, None
+
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(size, dtype=dtype, buffer=shm.buf), shm
+
+
+# DP tables of a worker process, set up by _attach
+_worker = {}
+
+
+def _attach(dists, refs, batch_size):
+    arrays, handles = zip(*[_open(ref) for ref in refs])
+    _worker.update(handles=handles,
+                   layers=_Layers(dists, arrays[:2], arrays[2], batch_size))
+
+
+def _relax_shared(batch):
+    _worker['layers'].relax(*batch)
+
+
+def branch_and_bound(dists, tour=None):
+    """
+    Exact solver for larger instances than Held-Karp can handle. It extends
+    paths from node 0 depth-first, and drops a path as soon as a lower bound
+    on its completions is no better than the best tour found so far.
+
+    The bound is the Lagrangian 1-tree bound of Held and Karp on the nodes
+    left to visit, computed on the cheaper direction of every edge so that
+    it also holds for asymmetric matrices.
+
+    Parameters:
+        dists: distance matrix
+        tour: optional tour to start pruning from, as a list of nodes or
+            as the (city, next city) moves AntColony.run returns
+
+    Returns:
+        A tuple, (cost, path).
+    """
+    dists = np.asarray(dists)
+    n = len(dists)
+    d = dists.astype(np.float64)
+    sym = np.minimum(d, d.T)
+    integral = np.issubdtype(dists.dtype, np.integer)
+
+    def length(path):
+        return sum(d[path[i - 1], path[i]] for i in range(n))
+
+    # Start from the given tour, or from the nearest neighbour tour
+    if tour is not None:
+        tour = [int(move[0]) if np.ndim(move) else int(move) for move in tour]
+        # Paths are extended from node 0, so the tour has to start there
+        start = tour.index(0)
+        tour = tour[start:] + tour[:start]
+    else:
+        tour = [0]
+        left = set(range(1, n))
+        while left:
+            tour.append(min(left, key=lambda j: d[tour[-1], j]))
+            left.remove(tour[-1])
+    best = [length(tour), list(tour)]
+
+    def pruned(lower):
+        # Only drop paths that cannot hold a strictly shorter tour, with
+        # some slack for rounding in the bound
+        if integral:
+            return math.ceil(lower - 1e-6) >= best[0]
+        return lower - 1e-9 * max(1.0, abs(best[0])) >= best[0]
+
+    def search(path, cost, left, pi):
+        last = path[-1]
+        if len(left) == 1:
+            j = left[0]
+            total = cost + d[last, j] + d[j, 0]
+            if total < best[0]:
+                best[:] = [total, path + [j]]
+            return
+
+        lower, pi = _one_tree_bound(d, sym, last, left, pi, best[0] - cost)
+        if pruned(cost + lower):
+            return
+
+        # Visit closer nodes first, to find good tours early
+        for i in np.argsort(d[last, left], kind='stable'):
+            j = left[i]
+            if pruned(cost + d[last, j]):
+                break
+            search(path + [j], cost + d[last, j],
+                   np.delete(left, i), np.delete(pi, i))
+
+    if n > 2:
+        search([0], 0.0, np.arange(1, n), np.zeros(n - 1))
+
+    path = [int(j) for j in best[1]]
+    opt = sum(dists[path[i - 1], path[i]] for i in range(n))
+    return opt.item(), path
+
+
+def _one_tree_bound(d, sym, last, left, pi, budget, iterations=None):
+    """
+    Lower bound on the cost of going from last through all nodes in left
+    and back to node 0, along with the node penalties it was reached with.
+
+    The path through left costs at least its minimum spanning tree, and the
+    edges into and out of it at least the cheapest ones from last and to
+    node 0. Adding a penalty pi[u] to every edge at node u and subtracting
+    2 * pi[u] keeps this a lower bound, and subgradient steps on pi push
+    the nodes of the tree towards degree 2, tightening it. The search stops
+    early once the bound exceeds budget.
+    """
+    m = len(left)
+    if iterations is None:
+        iterations = 50 if m == len(d) - 1 else 10
+    weights = sym[np.ix_(left, left)]
+    into = d[last, left]
+    out = d[left, 0]
+
+    best, best_pi = -np.inf, pi
+    step = None
+    for _ in range(iterations):
+        total, degree = _spanning_tree(weights + pi[:, None] + pi[None, :])
+        i = np.argmin(into + pi)
+        j = np.argmin(out + pi)
+        bound = total + into[i] + out[j] + pi[i] + pi[j] - 2 * pi.sum()
+        if bound > best:
+            best, best_pi = bound, pi
+        if best > budget:
+            break
+
+        degree[i] += 1
+        degree[j] += 1
+        gradient = degree - 2
+        norm = np.dot(gradient, gradient)
+        if not norm:
+            # Every node has degree 2, so the tree is a path and the bound
+            # cannot improve
+            break
+
+        # Polyak step towards the budget, shrinking as the bound stalls
+        if step is None:
+            step = 1.0
+        else:
+            step *= 0.9
+        gap = budget - bound if np.isfinite(budget) else abs(bound)
+        pi = pi + step * max(gap, 1e-9) / norm * gradient
+    return best, best_pi
+
+
+def _spanning_tree(weights):
+    """
+    Returns the total weight and node degrees of a minimum spanning tree of
+    a complete graph, built with Prim's algorithm.
+    """
+    m = len(weights)
+    degree = np.zeros(m, dtype=np.int64)
+    dist = weights[0].copy()
+    link = np.zeros(m, dtype=np.intp)
+    done = np.zeros(m, dtype=bool)
+    done[0] = True
+    dist[0] = np.inf
+    total = 0.0
+    for _ in range(m - 1):
+        j = np.argmin(dist)
+        total += dist[j]
+        degree[j] += 1
+        degree[link[j]] += 1
+        done[j] = True
+        dist[j] = np.inf
+
+        closer = (weights[j] < dist) & ~done
+        dist[closer] = weights[j][closer]
+        link[closer] = j
+    return total, degree
 
 
 def generate_distances(n):
@@ -987,27 +1769,165 @@ def generate_distances(n):
 
 
 def read_distances(filename):
-    dists = []
-    #with open(filename, 'rb') as f:
-    #    for line in f:
-    #        # Skip comments
-    #        if line[0] == '#':
-    #            continue
-    #
-    #        dists.append(map(int, map(str.strip, line.split(','))))*/
+    """
+    Reads a distance matrix from a file, by its extension:
+
+        .csv: one row per line with comma separated values, skipping lines
+            starting with '#'
+        .tsp: TSPLIB file with EXPLICIT edge weights or EUC_2D coordinates
+        .npy, .npz: NumPy array, memory-mapped when stored uncompressed.
+            From an .npz file, the array named 'dists' is read if there is
+            one, otherwise the first one.
+
+    Returns:
+        The distance matrix, as a NumPy array. Integer values are read as
+        integers.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.npy':
+        return np.load(filename, mmap_mode='r')
+    if ext == '.npz':
+        return _read_npz(filename)
+    if ext == '.tsp':
+        return _integral(_read_tsplib(filename))
+
+    dists = np.loadtxt(filename, delimiter=',', comments='#', ndmin=2)
+    return _integral(dists)
+
+
+def _integral(dists):
+    if np.isfinite(dists).all() and (dists == np.round(dists)).all():
+        return dists.astype(np.int64)
+    return dists
+
+
+def _read_npz(filename):
+    with zipfile.ZipFile(filename) as archive:
+        names = [name[:-4] for name in archive.namelist()]
+        name = 'dists' if 'dists' in names else names[0]
+        info = archive.getinfo(name + '.npy')
+        if info.compress_type != zipfile.ZIP_STORED:
+            with np.load(filename) as arrays:
+                return arrays[name]
+
+        # The member is stored as is after its local header, which has a
+        # fixed size part followed by the name and an extra field.
+        with open(filename, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_size, extra_size = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_size + extra_size)
+            if np.lib.format.read_magic(f) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            offset = f.tell()
+
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran_order else 'C')
+
+
+def _read_tsplib(filename):
+    """
+    Reads the distance matrix of a TSPLIB file. Supports EXPLICIT edge
+    weights in any of the row or column formats, and EUC_2D and CEIL_2D
+    coordinates.
+    """
+    with open(filename) as f:
+        text = f.read()
+
+    # Specification lines come first, as "KEY : VALUE"
+    spec = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if not sep:
+            break
+        spec[key.strip().upper()] = value.strip()
+    n = int(spec['DIMENSION'])
+    kind = spec.get('EDGE_WEIGHT_TYPE', '').upper()
+
+    section = 'EDGE_WEIGHT_SECTION' if kind == 'EXPLICIT' \
+        else 'NODE_COORD_SECTION'
+    data = re.split(r'\b%s\b' % section, text, maxsplit=1)
+    if len(data) < 2:
+        raise ValueError('%s has no %s' % (filename, section))
+    data = re.split(r'\bEOF\b|\b[A-Z_]+_SECTION\b', data[1], maxsplit=1)[0]
+    values = np.fromstring(data, sep=' ')
+
+    if kind == 'EXPLICIT':
+        return _explicit(values, n, spec.get('EDGE_WEIGHT_FORMAT', ''))
+
+    if kind not in ('EUC_2D', 'CEIL_2D'):
+        raise ValueError('unsupported EDGE_WEIGHT_TYPE %s' % kind)
+    coords = values.reshape(n, 3)[:, 1:]
+    rounding = np.ceil if kind == 'CEIL_2D' else _nint
+    dists = np.empty((n, n))
+    for start in range(0, n, _ROWS):
+        rows = coords[start:start + _ROWS, None, :] - coords[None, :, :]
+        dists[start:start + _ROWS] = rounding(np.hypot(rows[..., 0],
+                                                       rows[..., 1]))
+    return dists
+
 
+def _nint(x):
+    # TSPLIB rounds halves up, where np.round rounds them to even
+    return np.floor(x + 0.5)
+
+
+def _explicit(values, n, format):
+    format = format.upper()
+    if format == 'FULL_MATRIX':
+        return values.reshape(n, n)
+
+    # A column format lists the same values as the row format of the other
+    # triangle
+    format = {'UPPER_COL': 'LOWER_ROW', 'LOWER_COL': 'UPPER_ROW',
+              'UPPER_DIAG_COL': 'LOWER_DIAG_ROW',
+              'LOWER_DIAG_COL': 'UPPER_DIAG_ROW'}.get(format, format)
+    indices = {'UPPER_ROW': np.triu_indices(n, 1),
+               'LOWER_ROW': np.tril_indices(n, -1),
+               'UPPER_DIAG_ROW': np.triu_indices(n),
+               'LOWER_DIAG_ROW': np.tril_indices(n)}
+    if format not in indices:
+        raise ValueError('unsupported EDGE_WEIGHT_FORMAT %s' % format)
+
+    dists = np.zeros((n, n))
+    rows, cols = indices[format]
+    dists[rows, cols] = values
+    dists[cols, rows] = values
     return dists
 
 
 if __name__ == '__main__':
     start = time.time()
 
-    arg = sys.argv[1]
-
-    if arg.endswith('.csv'):
-        dists = read_distances(arg)
-    else:
+    parser = argparse.ArgumentParser(
+        description='Solve a TSP instance with Held-Karp.')
+    parser.add_argument('arg', help='number of nodes, or a file to read '
+                                    'the distance matrix from')
+    parser.add_argument('--branch-and-bound', action='store_true',
+                        help='solve with branch and bound instead')
+    parser.add_argument('--workers', type=int,
+                        help='number of processes to split layers between')
+    parser.add_argument('--speedup', action='store_true',
+                        help='also time the serial solver and report the '
+                             'speedup of the parallel one')
+    parser.add_argument('--spill', metavar='DIR',
+                        help='write parent pointers to a file in DIR')
+    parser.add_argument('--max-memory', type=float, metavar='GB',
+                        help='memory limit for the tables')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='save completed layers to FILE and '
+                             'FILE.parents, and resume from them if FILE '
+                             'exists')
+    args = parser.parse_args()
+    arg = args.arg
+
+    if arg.isdigit():
         dists = generate_distances(int(arg))
+    else:
+        dists = read_distances(arg)
 
     # Pretty-print the distance matrix
     for row in dists:
@@ -1015,7 +1935,21 @@ if __name__ == '__main__':
 
     print('')
 
-    print(held_karp(dists))
+    solved = time.time()
+    max_memory = args.max_memory and int(args.max_memory * 2**30)
+    if args.branch_and_bound:
+        print(branch_and_bound(dists))
+    else:
+        print(held_karp(dists, workers=args.workers, spill=args.spill,
+                        max_memory=max_memory, checkpoint=args.checkpoint))
+
+    if args.speedup:
+        parallel = time.time() - solved
+        solved = time.time()
+        held_karp(dists)
+        serial = time.time() - solved
+        print("\nserial %.3fs, %d workers %.3fs, speedup %.2fx"
+              % (serial, args.workers or 1, parallel, serial / parallel))
 
     end = time.time()
     print("\n",end - start)
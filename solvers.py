@@ -0,0 +1,108 @@
+"""
+Loads the two solvers from their directories, so that the tools at the top
+of the repository can use them side by side. held-karp.py cannot be imported
+by name because of the dash in its file name.
+
+solve picks between them from the size of the instance:
+
+    >>> result = solve(dists, time_budget=1.0)
+    >>> result.cost, result.tour, result.engine
+"""
+import collections
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(_ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+
+    # Registered so that worker processes can unpickle its functions
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+held_karp_module = _load('held_karp', 'held-karp-master/held-karp.py')
+ant_colony_module = _load('ant_colony',
+                          'AntColonyOptimization-master/ant_colony.py')
+
+held_karp = held_karp_module.held_karp
+branch_and_bound = held_karp_module.branch_and_bound
+estimate_held_karp = held_karp_module.estimate
+generate_distances = held_karp_module.generate_distances
+read_distances = held_karp_module.read_distances
+AntColony = ant_colony_module.AntColony
+Coordinates = ant_colony_module.Coordinates
+run_islands = ant_colony_module.run_islands
+
+
+# Result of solve. timings holds the seconds Held-Karp was estimated to take
+# (held_karp_estimate) and the seconds the solve took (solve).
+Result = collections.namedtuple('Result', ['cost', 'tour', 'engine',
+                                           'timings'])
+
+
+def solve(dists, time_budget=None, max_memory=None, **options):
+    """
+    Solves an instance exactly with held_karp when it is estimated to fit in
+    the time budget and memory, and with AntColony otherwise, which then
+    returns its best tour once the time budget runs out.
+
+    Parameters:
+        dists: distance matrix, or Coordinates
+        time_budget: seconds the exact solver may take. By default any
+            time, as long as the tables fit in memory.
+        max_memory: bytes the exact solver may use. By default half of the
+            physical memory.
+        options: keyword arguments of AntColony, overriding 20 ants, 5 best,
+            100 iterations, decay 0.95 and beta 2.
+
+    Returns:
+        A Result, with the tour as the list of nodes visited from node 0.
+    """
+    start = time.perf_counter()
+    if not isinstance(dists, Coordinates):
+        dists = np.asarray(dists)
+    n = len(dists)
+    if max_memory is None and _physical_memory() is not None:
+        max_memory = _physical_memory() // 2
+    seconds, memory = estimate_held_karp(n, dists.dtype)
+    fits = ((time_budget is None or seconds <= time_budget)
+            and (max_memory is None or memory <= max_memory))
+
+    if fits:
+        engine = 'held_karp'
+        cost, tour = held_karp(np.asarray(dists))
+    else:
+        engine = 'ant_colony'
+        options = dict({'n_ants': 20, 'n_best': 5, 'n_iterations': 100,
+                        'decay': 0.95, 'beta': 2}, **options)
+        distances = dists
+        if not isinstance(dists, Coordinates):
+            distances = dists.astype(np.float64)
+            np.fill_diagonal(distances, np.inf)
+        budget = None
+        if time_budget is not None:
+            budget = max(time_budget - (time.perf_counter() - start), 0)
+        path, cost = AntColony(distances, **options).run(budget)
+        tour = [move[0] for move in path]
+    timings = {'held_karp_estimate': seconds,
+               'solve': time.perf_counter() - start}
+    return Result(cost.item() if hasattr(cost, 'item') else cost,
+                  [int(i) for i in tour], engine, timings)
+
+
+def _physical_memory():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        # Not available on this platform
+        return None
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from solvers import AntColony, Coordinates
+
+
+def _distances(n, seed=0):
+    points = np.random.default_rng(seed).random((n, 2))
+    distances = np.hypot(*(points[:, None] - points[None]).transpose(2, 0, 1))
+    np.fill_diagonal(distances, np.inf)
+    return distances
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_resume_matches_uninterrupted_run(tmp_path, workers):
+    distances = _distances(40)
+    checkpoint = str(tmp_path / 'colony.npz')
+
+    colony = AntColony(distances, 10, 3, 20, 0.9, workers=workers, seed=7)
+    expected = colony.run()
+
+    # Stopped after 10 iterations, then resumed by a fresh colony
+    AntColony(distances, 10, 3, 10, 0.9, workers=workers,
+              seed=7).run(checkpoint=checkpoint)
+    resumed = AntColony(distances, 10, 3, 20, 0.9, workers=workers, seed=7)
+    assert resumed.run(checkpoint=checkpoint) == expected
+    np.testing.assert_array_equal(resumed.pheromone, colony.pheromone)
+
+
+def test_run_starts_over_without_checkpoint():
+    iterations = []
+    colony = AntColony(_distances(20), 5, 2, 10, 0.9, seed=1,
+                       callback=lambda stats: iterations.append(stats))
+    colony.run()
+    colony.run()
+    assert len(iterations) == 20
+
+
+def test_runs_draw_new_streams_with_workers():
+    # Without pheromone, tours only differ by the random numbers
+    colony = AntColony(_distances(20), 5, 2, 3, 0.9, alpha=0, workers=2,
+                       seed=3)
+    assert colony.run() != colony.run()
+
+
+def test_run_without_iterations():
+    assert AntColony(_distances(5), 5, 2, 0, 0.9).run() == ([], np.inf)
+
+
+@pytest.mark.parametrize('metric, coords', [
+    ('euclidean', np.random.default_rng(1).random((2000, 2))),
+    # Two tight clusters far apart, and a line
+    ('euclidean', np.r_[np.random.default_rng(2).normal(0, 1e-3, (800, 2)),
+                        np.random.default_rng(3).normal(100, 1e-3, (800, 2))]),
+    ('euclidean', np.c_[np.linspace(0, 1, 500), np.zeros(500)]),
+    # Repeated stops
+    ('euclidean', np.repeat(np.random.default_rng(4).random((50, 2)), 8, 0)),
+    ('haversine', np.c_[48.8 + np.random.default_rng(5).random(1500) * 0.2,
+                        2.3 + np.random.default_rng(6).random(1500) * 0.3]),
+])
+def test_nearest_matches_brute_force(metric, coords):
+    cities = Coordinates(coords, metric)
+    distances = np.asarray(cities)
+    nearest = cities.nearest(10)
+    expected = np.sort(distances, axis=1)[:, :10]
+    np.testing.assert_allclose(np.take_along_axis(distances, nearest, 1),
+                               expected)
+    assert (nearest != np.arange(len(coords))[:, None]).all()
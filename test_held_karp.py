@@ -0,0 +1,191 @@
+import math
+import os
+import zipfile
+
+import numpy as np
+import pytest
+
+from solvers import held_karp, held_karp_module
+
+
+def _distances(n, seed=0):
+    rng = np.random.default_rng(seed)
+    dists = rng.integers(1, 6, (n, n))
+    np.fill_diagonal(dists, 0)
+    return dists
+
+
+# 0 and a huge value force the sparse update and the full relax of layers
+@pytest.mark.parametrize('update_steps', [0, held_karp_module.UPDATE_STEPS,
+                                          10 ** 9])
+def test_incremental_update_matches_cold_solve(monkeypatch, update_steps):
+    monkeypatch.setattr(held_karp_module, 'UPDATE_STEPS', update_steps)
+    rng = np.random.default_rng(update_steps)
+    for n in range(2, 10):
+        dists = _distances(n, n)
+        solver = held_karp_module.IncrementalHeldKarp(dists)
+        assert solver.solve() == held_karp(dists)
+        for _ in range(10):
+            changes = {}
+            for _ in range(rng.integers(1, 4)):
+                # Edges out of and into node 0 as well as between the others,
+                # with few values so that ties are common
+                i, j = (int(x) for x in rng.integers(0, n, 2))
+                if rng.random() < 0.3:
+                    i, j = (0, j) if rng.random() < 0.5 else (j, 0)
+                changes[i, j] = int(rng.integers(1, 6))
+            for (i, j), dist in changes.items():
+                if i != j:
+                    dists[i, j] = dist
+            assert solver.update(changes) == held_karp(dists)
+
+
+def test_incremental_update_to_fractional_distance():
+    dists = _distances(7, 1)
+    solver = held_karp_module.IncrementalHeldKarp(dists)
+    solver.solve()
+
+    # Integer distances would truncate these to 0
+    expected = dists.astype(np.float64)
+    for edge in [(2, 3), (0, 1), (4, 0)]:
+        expected[edge] = 0.4
+        assert solver.update({edge: 0.4}) == held_karp(expected)
+
+
+class _Stop(Exception):
+    pass
+
+
+def _stop_in_layer_6(batch):
+    # Only the first range of layer 6 completes, so the solve stops with
+    # the layer half written
+    if batch[0] == 6 and batch[1] > 0:
+        raise _Stop
+    held_karp_module._Layers.relax(held_karp_module._worker['layers'],
+                                   *batch)
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_checkpoint_resumes_interrupted_solve(tmp_path, monkeypatch,
+                                              workers):
+    dists = _distances(12, 3)
+    checkpoint = str(tmp_path / 'solve.npz')
+
+    relax = held_karp_module._Layers.relax
+    save_layers = held_karp_module._save_layers
+
+    def skip_layer_5(filename, dists, layers, subset_size):
+        # Leaves the parents of layer 5 in the file, but not in the costs
+        if subset_size != 5:
+            save_layers(filename, dists, layers, subset_size)
+
+    def stop_in_layer_6(layers, subset_size, start, end):
+        if subset_size == 6:
+            relax(layers, subset_size, start, (start + end) // 2)
+            raise _Stop
+        relax(layers, subset_size, start, end)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(held_karp_module, '_save_layers', skip_layer_5)
+        if workers is None:
+            patch.setattr(held_karp_module._Layers, 'relax', stop_in_layer_6)
+        else:
+            patch.setattr(held_karp_module, '_relax_shared', _stop_in_layer_6)
+        with pytest.raises(_Stop):
+            held_karp(dists, workers=workers, checkpoint=checkpoint,
+                      checkpoint_interval=0)
+
+    assert held_karp(dists, workers=workers, checkpoint=checkpoint) \
+        == held_karp(dists)
+    # Every layer's parents once, one byte each
+    assert os.path.getsize(checkpoint + '.parents') \
+        == sum(math.comb(11, s) * s for s in range(1, 12))
+
+
+def _npz_member(archive, name, array, extra=b'', version=None):
+    # Stored uncompressed, like np.savez, with an optional extra field
+    # between the member's local header and its data
+    info = zipfile.ZipInfo(name + '.npy')
+    info.extra = extra
+    with archive.open(info, 'w') as f:
+        np.lib.format.write_array(f, array, version=version)
+
+
+@pytest.mark.parametrize('extra, version', [(b'', None),
+                                            (b'\xfe\xca\x04\x00abcd', None),
+                                            (b'', (2, 0))])
+def test_read_npz_maps_stored_member(tmp_path, extra, version):
+    filename = str(tmp_path / 'dists.npz')
+    first = np.arange(6).reshape(2, 3)
+    dists = np.asfortranarray(_distances(5))
+    with zipfile.ZipFile(filename, 'w') as archive:
+        _npz_member(archive, 'first_array_of_the_archive', first)
+        _npz_member(archive, 'dists', dists, extra, version)
+
+    read = held_karp_module.read_distances(filename)
+    assert isinstance(read, np.memmap)
+    np.testing.assert_array_equal(read, dists)
+
+
+def test_read_npz_without_dists(tmp_path):
+    stored = str(tmp_path / 'stored.npz')
+    compressed = str(tmp_path / 'compressed.npz')
+    dists = _distances(5)
+    np.savez(stored, a=dists, b=dists.T)
+    np.savez_compressed(compressed, a=dists, b=dists.T)
+    for filename in (stored, compressed):
+        np.testing.assert_array_equal(
+            held_karp_module.read_distances(filename), dists)
+
+
+# Order in which each TSPLIB format lists the entries (i, j) of a matrix
+_FORMATS = {
+    'FULL_MATRIX': lambda n: [(i, j) for i in range(n) for j in range(n)],
+    'UPPER_ROW': lambda n: [(i, j) for i in range(n) for j in range(i + 1, n)],
+    'LOWER_ROW': lambda n: [(i, j) for i in range(n) for j in range(i)],
+    'UPPER_DIAG_ROW': lambda n: [(i, j) for i in range(n)
+                                 for j in range(i, n)],
+    'LOWER_DIAG_ROW': lambda n: [(i, j) for i in range(n)
+                                 for j in range(i + 1)],
+    'UPPER_COL': lambda n: [(i, j) for j in range(n) for i in range(j)],
+    'LOWER_COL': lambda n: [(i, j) for j in range(n)
+                            for i in range(j + 1, n)],
+    'UPPER_DIAG_COL': lambda n: [(i, j) for j in range(n)
+                                 for i in range(j + 1)],
+    'LOWER_DIAG_COL': lambda n: [(i, j) for j in range(n)
+                                 for i in range(j, n)],
+}
+
+
+@pytest.mark.parametrize('format', sorted(_FORMATS))
+def test_read_tsplib_explicit(tmp_path, format):
+    n = 6
+    dists = _distances(n, 2)
+    dists = np.minimum(dists, dists.T)
+    values = [str(dists[i, j]) for i, j in _FORMATS[format](n)]
+    filename = str(tmp_path / 'explicit.tsp')
+    with open(filename, 'w') as f:
+        f.write('NAME : explicit\nTYPE : TSP\nDIMENSION : %d\n'
+                'EDGE_WEIGHT_TYPE : EXPLICIT\nEDGE_WEIGHT_FORMAT : %s\n'
+                'EDGE_WEIGHT_SECTION\n' % (n, format))
+        # Values wrap across lines regardless of the rows of the matrix
+        for start in range(0, len(values), 4):
+            f.write(' '.join(values[start:start + 4]) + '\n')
+        f.write('EOF\n')
+
+    read = held_karp_module.read_distances(filename)
+    assert read.dtype == np.int64
+    np.testing.assert_array_equal(read, dists)
+
+
+@pytest.mark.parametrize('kind, expected', [('EUC_2D', [5, 1, 1]),
+                                            ('CEIL_2D', [5, 1, 2])])
+def test_read_tsplib_coordinates(tmp_path, kind, expected):
+    filename = str(tmp_path / 'coords.tsp')
+    with open(filename, 'w') as f:
+        f.write('DIMENSION : 4\nEDGE_WEIGHT_TYPE : %s\nNODE_COORD_SECTION\n'
+                '1 0 0\n2 3 4\n3 0.5 0\n4 1 1\nEOF\n' % kind)
+
+    # 0.5 from node 1 to 3 rounds half up, 1.41 to node 4 up or to the nearest
+    read = held_karp_module.read_distances(filename)
+    assert [read[0, 1], read[0, 2], read[0, 3]] == expected